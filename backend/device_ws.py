@@ -0,0 +1,314 @@
+"""
+Постоянный WebSocket-канал для настольного робота (ESP32).
+
+Вместо нового HTTPS-запроса на каждый /ask устройство держит одно
+соединение /ws. Протокол — JSON-сообщения с полем "type":
+
+  устройство -> сервер:
+    {"type": "hello", "device_id": "...", "token": "...",
+     "session": "<id для resume>", "last_seq": 12}      – первое сообщение
+    {"type": "ask", "id": "r1", "question": "...",
+     "mode": "device"}                                   – вопрос (mode необязателен)
+    {"type": "cancel", "id": "r1"}                       – отменить вопрос
+    {"type": "ack", "seq": 15}                           – подтверждение получения
+    {"type": "ping"} / {"type": "pong"}                  – heartbeat
+
+  сервер -> устройство:
+    {"type": "welcome", "session": "...", "resumed": true, "heartbeat": 20, "seq": 15}
+    {"type": "chunk", "id": "r1", "seq": 16, "text": "..."}
+    {"type": "done", "id": "r1", "seq": 17}
+    {"type": "error", "id": "r1", "seq": 18, "error": "..."}
+    {"type": "error", "id": "r1", "seq": 19, "error": "busy", "retry_after": 10}
+    {"type": "ping"} / {"type": "pong"}
+
+Сообщения с "seq" (ответы на вопросы) хранятся в буфере сессии, пока
+устройство не пришлёт ack. После обрыва связи устройство переподключается
+с тем же session и last_seq — сервер досылает всё, что оно не получило.
+
+Токен у каждого устройства свой: HMAC-SHA256 от device_id с ключом
+DEVICE_TOKEN (hex). Утечка прошивки одного робота не даёт подключиться
+под чужим device_id. Токен для прошивки:
+    python -c "from backend.device_ws import device_token; print(device_token('desk-1'))"
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from collections import deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from backend.gpt import GENERATION_PROFILES, ask_gpt
+from backend.limiter import Overloaded, ask_limiter
+from config.settings import settings
+
+HELLO_TIMEOUT = 10  # сек на первое сообщение hello
+HEARTBEAT_INTERVAL = 20  # сек между ping, если устройство молчит
+HEARTBEAT_TIMEOUT = 60  # после стольких секунд тишины соединение закрываем
+SESSION_TTL = 300  # сколько держим сессию после обрыва (для resume)
+REPLAY_BUFFER_SIZE = 64  # сколько неподтверждённых сообщений храним
+CHUNK_SIZE = 64  # размер кусочка ответа (маленький дисплей и мало RAM)
+MAX_INFLIGHT = 4  # сколько вопросов одно устройство может задать параллельно
+
+
+def split_chunks(text: str, size: int = CHUNK_SIZE) -> list[str]:
+    """Режем ответ на кусочки до size символов, по возможности по пробелам."""
+    chunks: list[str] = []
+    while len(text) > size:
+        cut = text.rfind(" ", 0, size) + 1 or size
+        chunks.append(text[:cut])
+        text = text[cut:]
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class DeviceSession:
+    """Состояние одного устройства: живёт дольше, чем отдельное соединение."""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.session_id = secrets.token_urlsafe(12)
+        self.seq = 0
+        self.buffer: deque[dict] = deque(maxlen=REPLAY_BUFFER_SIZE)
+        self.websocket: WebSocket | None = None
+        self.detached_at: float | None = None
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.send_lock = asyncio.Lock()
+
+    async def push(self, msg: dict) -> None:
+        """Отправка сообщения с seq. Без соединения оно ждёт в буфере до resume."""
+        async with self.send_lock:
+            self.seq += 1
+            msg = {**msg, "seq": self.seq}
+            self.buffer.append(msg)
+            if self.websocket is None:
+                return
+            try:
+                await self.websocket.send_json(msg)
+            except Exception:
+                # Соединение оборвалось — сообщение останется в буфере
+                pass
+
+    async def send_control(self, websocket: WebSocket, msg: dict) -> None:
+        """Служебные сообщения (ping/pong/ошибки протокола) без seq и буфера."""
+        async with self.send_lock:
+            if self.websocket is websocket:
+                await websocket.send_json(msg)
+
+    def ack(self, seq: int) -> None:
+        while self.buffer and self.buffer[0]["seq"] <= seq:
+            self.buffer.popleft()
+
+    def start_ask(self, request_id: str, question: str, mode: str = "device") -> str | None:
+        """Запускаем вопрос в фоне. Возвращает текст ошибки, если не получилось."""
+        if not request_id:
+            return "missing id"
+        if not question:
+            return "empty question"
+        if mode not in GENERATION_PROFILES:
+            return "unknown mode"
+        if request_id in self.tasks:
+            return "duplicate id"
+        if len(self.tasks) >= MAX_INFLIGHT:
+            return "too many requests"
+
+        self.tasks[request_id] = asyncio.create_task(
+            self._run_ask(request_id, question, mode)
+        )
+        return None
+
+    async def _run_ask(self, request_id: str, question: str, mode: str) -> None:
+        try:
+            async with ask_limiter.slot():
+                answer = await ask_gpt(question, mode)
+            for piece in split_chunks(answer):
+                await self.push({"type": "chunk", "id": request_id, "text": piece})
+            await self.push({"type": "done", "id": request_id})
+        except asyncio.CancelledError:
+            raise
+        except Overloaded as e:
+            await self.push({
+                "type": "error",
+                "id": request_id,
+                "error": "busy",
+                "retry_after": e.retry_after,
+            })
+        except Exception as e:
+            print("Device ws ask error:", e)
+            await self.push({"type": "error", "id": request_id, "error": "ask failed"})
+        finally:
+            self.tasks.pop(request_id, None)
+
+    def cancel(self, request_id: str) -> None:
+        task = self.tasks.get(request_id)
+        if task:
+            task.cancel()
+
+    def cancel_all(self) -> None:
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+
+# device_id -> сессия (одна на устройство)
+sessions: dict[str, DeviceSession] = {}
+
+
+def device_token(device_id: str) -> str:
+    """Токен устройства, выведенный из серверного секрета DEVICE_TOKEN."""
+    key = (settings.device_token or "").encode()
+    return hmac.new(key, device_id.encode(), hashlib.sha256).hexdigest()
+
+
+def _check_token(device_id: str, token) -> bool:
+    if not settings.device_token:
+        # Без настроенного секрета канал закрыт для всех
+        return False
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(token.encode(), device_token(device_id).encode())
+
+
+def _purge_expired() -> None:
+    now = time.monotonic()
+    for device_id, session in list(sessions.items()):
+        if session.detached_at is not None and now - session.detached_at > SESSION_TTL:
+            session.cancel_all()
+            del sessions[device_id]
+
+
+async def _receive(websocket: WebSocket) -> dict:
+    data = json.loads(await websocket.receive_text())
+    if not isinstance(data, dict):
+        raise ValueError("message must be a JSON object")
+    return data
+
+
+async def _close(websocket: WebSocket, code: int, reason: str) -> None:
+    try:
+        await websocket.close(code=code, reason=reason)
+    except Exception:
+        pass
+
+
+async def _attach(device_id: str, websocket: WebSocket, hello: dict) -> DeviceSession:
+    """Новая сессия или resume старой; старое соединение устройства закрываем."""
+    _purge_expired()
+
+    session = sessions.get(device_id)
+    resumed = bool(session and hello.get("session") == session.session_id)
+    if not resumed:
+        if session:
+            session.cancel_all()
+            if session.websocket is not None:
+                await _close(session.websocket, 4000, "replaced by new connection")
+        session = DeviceSession(device_id)
+        sessions[device_id] = session
+
+    async with session.send_lock:
+        old = session.websocket
+        session.websocket = websocket
+        session.detached_at = None
+
+        await websocket.send_json({
+            "type": "welcome",
+            "session": session.session_id,
+            "resumed": resumed,
+            "heartbeat": HEARTBEAT_INTERVAL,
+            "seq": session.seq,
+        })
+
+        if resumed:
+            try:
+                session.ack(int(hello.get("last_seq") or 0))
+            except (TypeError, ValueError):
+                pass
+            for msg in list(session.buffer):
+                await websocket.send_json(msg)
+
+    if old is not None and old is not websocket:
+        await _close(old, 4000, "replaced by new connection")
+
+    return session
+
+
+async def _serve(session: DeviceSession, websocket: WebSocket) -> None:
+    last_seen = time.monotonic()
+
+    while True:
+        try:
+            msg = await asyncio.wait_for(_receive(websocket), timeout=HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            if time.monotonic() - last_seen > HEARTBEAT_TIMEOUT:
+                await _close(websocket, 1001, "heartbeat timeout")
+                return
+            await session.send_control(websocket, {"type": "ping"})
+            continue
+        except (ValueError, KeyError):
+            # KeyError — бинарный кадр вместо текстового
+            await session.send_control(websocket, {"type": "error", "error": "bad json"})
+            continue
+
+        last_seen = time.monotonic()
+        kind = msg.get("type")
+
+        if kind == "ping":
+            await session.send_control(websocket, {"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "ack":
+            try:
+                session.ack(int(msg.get("seq") or 0))
+            except (TypeError, ValueError):
+                pass
+        elif kind == "ask":
+            request_id = str(msg.get("id") or "").strip()
+            question = str(msg.get("question") or "").strip()
+            mode = str(msg.get("mode") or "device")
+            error = session.start_ask(request_id, question, mode)
+            if error:
+                await session.send_control(
+                    websocket, {"type": "error", "id": request_id, "error": error}
+                )
+        elif kind == "cancel":
+            session.cancel(str(msg.get("id") or ""))
+        else:
+            await session.send_control(websocket, {"type": "error", "error": "unknown type"})
+
+
+async def handle_device_socket(websocket: WebSocket) -> None:
+    """Обработчик /ws: hello + авторизация, затем цикл приёма сообщений."""
+    await websocket.accept()
+
+    try:
+        hello = await asyncio.wait_for(_receive(websocket), timeout=HELLO_TIMEOUT)
+        device_id = str(hello.get("device_id") or "").strip()
+        valid = hello.get("type") == "hello" and bool(device_id)
+    except WebSocketDisconnect:
+        return
+    except Exception:
+        # Таймаут, не JSON, бинарный кадр — всё это плохой hello
+        valid = False
+
+    if not valid:
+        await _close(websocket, 1008, "hello expected")
+        return
+    if not _check_token(device_id, hello.get("token")):
+        await _close(websocket, 1008, "unauthorized")
+        return
+
+    session = None
+    try:
+        session = await _attach(device_id, websocket, hello)
+        await _serve(session, websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    except Exception as e:
+        print("Device ws error:", e)
+    finally:
+        if session is not None and session.websocket is websocket:
+            session.websocket = None
+            session.detached_at = time.monotonic()
@@ -1,8 +1,12 @@
+import asyncio
 import re
+
 import requests
 from openai import OpenAI
 from bs4 import BeautifulSoup
 
+from backend.intents import router
+from backend.weather import describe_missing, find_places, get_current_weather
 from config.settings import settings
 
 client = OpenAI(api_key=settings.openai_api_key)
@@ -116,121 +120,158 @@ def get_orginfo_from_url(url: str) -> str:
         return "Не удалось получить или разобрать данные с orginfo.uz по указанной ссылке."
 
 
-# ---------- Погода в Ташкенте ----------
-
-def get_weather_tashkent() -> str:
+# ---------- Профили генерации по режимам ----------
+
+# Режим запроса -> модель, лимит токенов, температура (None – по умолчанию API),
+# system prompt и максимальная длина ответа. Короткие режимы идут в быструю дешёвую модель
+# с маленьким лимитом — меньше задержка и меньше лишней генерации.
+GENERATION_PROFILES: dict[str, dict] = {
+    "normal": {
+        "model": settings.openai_model,
+        "max_tokens": 180,
+        "temperature": None,
+        "system_prompt": (
+            "Ты кратко и понятно отвечаешь для настольного робота "
+            "с маленьким дисплеем 128x64. Не пиши слишком длинные тексты."
+        ),
+        "max_chars": 600,
+    },
+    "short": {
+        "model": settings.openai_fast_model,
+        "max_tokens": 80,
+        "temperature": 0.5,
+        "system_prompt": (
+            "Ты ассистент настольного робота. "
+            "Отвечай очень коротко: 1–2 предложения, без списков и вступлений."
+        ),
+        "max_chars": 300,
+    },
+    "device": {
+        "model": settings.openai_fast_model,
+        "max_tokens": 60,
+        "temperature": 0.3,
+        "system_prompt": (
+            "Ты голос настольного робота с дисплеем 128x64. "
+            "Отвечай одним-двумя короткими предложениями простым текстом, "
+            "без markdown, эмодзи и списков."
+        ),
+        "max_chars": 200,
+    },
+}
+
+DEFAULT_MODE = "normal"
+
+# Минимальный запас на один город в ответе о погоде (одно предложение)
+WEATHER_TOKENS_PER_CITY = 40
+WEATHER_CHARS_PER_CITY = 120
+
+
+def get_profile(mode: str | None) -> dict:
+    """Профиль генерации для режима (неизвестный режим -> normal)."""
+    return GENERATION_PROFILES.get(mode or DEFAULT_MODE, GENERATION_PROFILES[DEFAULT_MODE])
+
+
+# ---------- Намерения (tool handlers) для ask_gpt ----------
+
+# Ссылка orginfo.uz важнее остальных намерений (как и до роутера)
+@router.register("orginfo_url", ORGINFO_URL_RE.pattern, priority=10)
+async def orginfo_url_intent(user_text: str, match: re.Match) -> str:
+    """Ссылка orginfo.uz/organization/... — парсим её и возвращаем карточку."""
+    return await asyncio.to_thread(get_orginfo_from_url, match.group("orginfo_url"))
+
+
+@router.register("weather", r"\bпогод\w*")
+async def weather_intent(user_text: str, match: re.Match) -> dict:
     """
-    Получаем текущую погоду в Ташкенте через Open-Meteo (без API ключа).
-    Возвращаем короткую строку-факт для GPT.
+    Погода в одном или нескольких городах: реальные данные Open-Meteo,
+    GPT только формулирует короткий ответ.
     """
-    try:
-        lat = 41.31
-        lon = 69.28
-
-        url = (
-            "https://api.open-meteo.com/v1/forecast"
-            f"?latitude={lat}&longitude={lon}&current=temperature_2m,weather_code"
-            "&timezone=Asia/Tashkent"
-        )
+    # Блокирующие HTTP-запросы уводим в поток, чтобы не держать event loop
+    # (через WebSocket у одного устройства может идти несколько вопросов сразу)
+    places, missing = await asyncio.to_thread(find_places, user_text)
+    facts: list[str] = []
+    if places:
+        facts.append(await asyncio.to_thread(get_current_weather, places))
+    if missing:
+        facts.append(describe_missing(missing))
+    raw_weather = "\n".join(facts)
+
+    system_prompt = (
+        "Ты ассистент настольного робота. "
+        "Тебе дали актуальные данные о погоде из внешнего источника. "
+        "Используй ИХ как истину и не придумывай свои числа. "
+        "Если город не найден — так и скажи, не подставляй другой город. "
+        "Ответь ОЧЕНЬ коротко на русском: по одному предложению на город, "
+        "обязательно укажи температуру в градусах и состояние погоды."
+    )
 
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+    user_prompt = (
+        f"Пользователь спросил: {user_text}\n\n"
+        f"Данные внешнего источника:\n{raw_weather}\n\n"
+        "Сформулируй короткий ответ."
+    )
 
-        current = data.get("current", {})
-        temp = current.get("temperature_2m")
-        code = current.get("weather_code")
-
-        if temp is None:
-            return "Нет актуальных данных о температуре."
-
-        description = "ясно"
-        if code is not None:
-            if code in (0,):
-                description = "ясно"
-            elif code in (1, 2, 3):
-                description = "переменная облачность"
-            elif 51 <= code <= 67:
-                description = "морось или небольшой дождь"
-            elif 71 <= code <= 77:
-                description = "снег"
-            elif 80 <= code <= 82:
-                description = "дождь"
-            elif 95 <= code <= 99:
-                description = "гроза"
-
-        return f"Ташкент: сейчас около {temp:.0f} °C, {description}."
-    except Exception as e:
-        print("Weather error:", e)
-        return "Не удалось получить погоду для Ташкента (ошибка запроса)."
+    # По предложению на город: лимиты профиля (device – 60 токенов)
+    # поднимаем, чтобы ответ о нескольких городах не обрезался
+    cities = len(places) + len(missing)
+    return {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "max_tokens": WEATHER_TOKENS_PER_CITY * cities,
+        "max_chars": WEATHER_CHARS_PER_CITY * cities,
+    }
 
 
 # ---------- Основная функция GPT для /ask ----------
 
-async def ask_gpt(text: str) -> str:
+async def ask_gpt(text: str, mode: str = DEFAULT_MODE) -> str:
     """
-    Общая функция для Telegram и (потом) ESP32.
-    - Если в тексте есть ссылка orginfo.uz/organization/... — парсим её и возвращаем карточку.
-    - Если вопрос про погоду в Ташкенте — берём реальные данные, потом GPT формулирует короткий ответ.
-    - Иначе обычный короткий ответ GPT.
+    Общая функция для Telegram и ESP32.
+    - Сначала роутер намерений (backend/intents.py): ссылка orginfo.uz,
+      погода в любых городах и т.д.
+    - Обработчик может вернуть готовый ответ или сообщения для GPT.
+    - Если намерение не найдено — обычный ответ GPT.
+    - mode выбирает профиль генерации (GENERATION_PROFILES): normal / short / device.
     """
     if not settings.openai_api_key:
         return "GPT не настроен: нет OPENAI_API_KEY"
 
     user_text = (text or "").strip()
-    lower = user_text.lower()
-
-    # 1) Если пользователь прислал ссылку orginfo.uz/organization/...
-    url_match = ORGINFO_URL_RE.search(user_text)
-    if url_match:
-        url = url_match.group(0)
-        return get_orginfo_from_url(url)
-
-    # 2) Погода в Ташкенте
-    is_tashkent_weather = ("погода" in lower) and ("ташкент" in lower)
-
-    if is_tashkent_weather:
-        raw_weather = get_weather_tashkent()
-
-        system_prompt = (
-            "Ты ассистент настольного робота. "
-            "Тебе дали актуальные данные о погоде из внешнего источника. "
-            "Используй ИХ как истину и не придумывай свои числа. "
-            "Ответь ОЧЕНЬ коротко (одно предложение) на русском, "
-            "обязательно укажи температуру в градусах и состояние погоды."
-        )
-
-        user_prompt = (
-            f"Пользователь спросил: {user_text}\n\n"
-            f"Данные внешнего источника:\n{raw_weather}\n\n"
-            "Сформулируй один короткий ответ."
-        )
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
+    profile = get_profile(mode)
+
+    routed = await router.dispatch(user_text)
+    if isinstance(routed, str):
+        return routed
+
+    max_tokens = profile["max_tokens"]
+    max_chars = profile["max_chars"]
+    if routed:
+        # Намерение может поднять лимиты профиля (но не опустить)
+        messages = routed["messages"]
+        max_tokens = max(max_tokens, routed.get("max_tokens", 0))
+        max_chars = max(max_chars, routed.get("max_chars", 0))
     else:
-        # 3) Обычный режим GPT
         messages = [
-            {
-                "role": "system",
-                "content": (
-                    "Ты кратко и понятно отвечаешь для настольного робота "
-                    "с маленьким дисплеем 128x64. Не пиши слишком длинные тексты."
-                ),
-            },
+            {"role": "system", "content": profile["system_prompt"]},
             {"role": "user", "content": user_text},
         ]
 
+    extra = {}
+    if profile["temperature"] is not None:
+        extra["temperature"] = profile["temperature"]
+
     try:
-        completion = client.chat.completions.create(
-            model=settings.openai_model,
+        completion = await asyncio.to_thread(
+            client.chat.completions.create,
+            model=profile["model"],
             messages=messages,
-            max_tokens=180,
+            max_tokens=max_tokens,
+            **extra,
         )
         answer = completion.choices[0].message.content.strip()
-        return answer[:600]
+        return answer[:max_chars]
     except Exception as e:
         print("OpenAI error:", e)
         return "Ошибка при обращении к OpenAI API."
@@ -329,7 +370,7 @@ async def handle_orginfo_query(user_text: str) -> str:
     url_match = ORGINFO_URL_RE.search(user_text)
     if url_match:
         url = url_match.group(0)
-        return get_orginfo_from_url(url)
+        return await asyncio.to_thread(get_orginfo_from_url, url)
 
     # 1) Просим GPT сформировать поисковую фразу
     try:
@@ -341,7 +382,8 @@ async def handle_orginfo_query(user_text: str) -> str:
             "которую можно подставить в Google: site:orginfo.uz <фраза>. "
             "Не объясняй, не добавляй лишнего, просто выдай одну строку поиска."
         )
-        completion = client.chat.completions.create(
+        completion = await asyncio.to_thread(
+            client.chat.completions.create,
             model=settings.openai_model,
             messages=[
                 {"role": "system", "content": sys_prompt},
@@ -355,11 +397,12 @@ async def handle_orginfo_query(user_text: str) -> str:
         search_query = user_text
 
     # 2) Сначала пробуем найти компании через SerpAPI
-    urls = serpapi_search_orginfo(search_query, max_results=5)
+    # (блокирующие HTTP-запросы — в потоке, чтобы не держать event loop)
+    urls = await asyncio.to_thread(serpapi_search_orginfo, search_query, 5)
 
     # 3) Если SerpAPI ничего не нашёл, пробуем Google CSE (если настроен)
     if not urls:
-        urls = google_search_orginfo(search_query, max_results=5)
+        urls = await asyncio.to_thread(google_search_orginfo, search_query, 5)
 
     if not urls:
         return (
@@ -370,7 +413,7 @@ async def handle_orginfo_query(user_text: str) -> str:
     # 4) Парсим каждую найденную организацию
     cards: list[str] = []
     for url in urls:
-        card = get_orginfo_from_url(url)
+        card = await asyncio.to_thread(get_orginfo_from_url, url)
         cards.append(card)
 
     return "\n\n--------------------\n\n".join(cards)
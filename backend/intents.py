@@ -0,0 +1,74 @@
+"""
+Роутер намерений для ask_gpt.
+
+Обработчики регистрируются с регуляркой-триггером и приоритетом. Все триггеры
+склеиваются в одну заранее скомпилированную регулярку с именованными группами
+(ветки по убыванию приоритета), поэтому проверка сообщения — один вызов regex.
+Если ничего не совпало, сообщение сразу уходит в обычный GPT.
+
+Обработчик получает текст пользователя и объект совпадения и возвращает:
+- str – готовый ответ (GPT не вызывается);
+- dict – {"messages": [...]} для GPT (например, с данными внешнего источника)
+  и, по желанию, "max_tokens"/"max_chars", если ответу нужно больше места,
+  чем даёт профиль режима.
+"""
+
+import re
+from typing import Awaitable, Callable, Union
+
+IntentResult = Union[str, dict]
+IntentHandler = Callable[[str, re.Match], Awaitable[IntentResult]]
+
+
+class IntentRouter:
+    def __init__(self):
+        self._handlers: dict[str, IntentHandler] = {}
+        self._patterns: dict[str, str] = {}
+        self._priorities: dict[str, int] = {}
+        self._regex: re.Pattern | None = None
+
+    def register(self, name: str, pattern: str, priority: int = 0):
+        """
+        Декоратор: регистрирует обработчик под именем name (должно быть
+        валидным именем группы regex). Если в тексте совпало несколько
+        намерений, срабатывает то, у которого priority больше (при равном —
+        зарегистрированное раньше), независимо от места в тексте.
+        """
+        def decorator(handler: IntentHandler) -> IntentHandler:
+            self._handlers[name] = handler
+            self._patterns[name] = pattern
+            self._priorities[name] = priority
+            self._regex = None  # пересоберём при следующем match
+            return handler
+
+        return decorator
+
+    def _compiled(self) -> re.Pattern | None:
+        if self._regex is None and self._patterns:
+            # sorted() устойчивая: при равном приоритете сохраняется порядок регистрации
+            names = sorted(self._patterns, key=lambda n: -self._priorities[n])
+            # ^(?:.*?(?P<a>...)|.*?(?P<b>...)): ветка a проверяется по всему
+            # тексту раньше ветки b, поэтому выигрывает приоритет, а не позиция
+            combined = "|".join(f".*?(?P<{name}>{self._patterns[name]})" for name in names)
+            self._regex = re.compile(f"^(?:{combined})", re.IGNORECASE | re.DOTALL)
+        return self._regex
+
+    def match(self, text: str) -> tuple[IntentHandler, re.Match] | None:
+        regex = self._compiled()
+        if regex is None:
+            return None
+        m = regex.match(text)
+        if not m or not m.lastgroup:
+            return None
+        return self._handlers[m.lastgroup], m
+
+    async def dispatch(self, text: str) -> IntentResult | None:
+        """Вызывает подходящий обработчик; None – намерение не найдено."""
+        found = self.match(text)
+        if found is None:
+            return None
+        handler, m = found
+        return await handler(text, m)
+
+
+router = IntentRouter()
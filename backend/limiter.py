@@ -0,0 +1,122 @@
+"""
+Ограничение параллельных запросов с ограниченной очередью ожидания.
+
+Если все слоты заняты, запрос ждёт в очереди. Когда очередь полна или
+ожидание дольше max_wait — сразу бросаем Overloaded, а эндпоинт отвечает
+503 с Retry-After, вместо того чтобы держать запрос до таймаута.
+
+Запрос может ещё сократить ожидание (slot(max_wait=...)): например, если
+клиент всё равно отвалится раньше, чем мы успеем ответить.
+"""
+
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+
+from config.settings import settings
+
+
+class Overloaded(Exception):
+    """Сервер перегружен: очередь полна или ожидание слота слишком долгое."""
+
+    def __init__(self, name: str, retry_after: int, waiting: int):
+        super().__init__(f"{name}: overloaded")
+        self.retry_after = retry_after
+        self.waiting = waiting
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for fut in self._waiters if not fut.done())
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    def _overloaded(self) -> Overloaded:
+        return Overloaded(self.name, self.retry_after(), self.waiting)
+
+    async def acquire(self, max_wait: float | None = None) -> None:
+        wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return
+
+        if self.waiting >= self.max_queue or wait <= 0:
+            raise self._overloaded()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            # Слот передаёт release(): active при этом не меняется
+            await asyncio.wait_for(fut, timeout=wait)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # release() передал слот в тот же момент, что истёк таймаут —
+                # возвращаем его, иначе слот потеряется навсегда
+                self.release()
+            else:
+                self._discard(fut)
+            raise self._overloaded()
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже передали нам, но запрос отменён — отдаём дальше
+                self.release()
+            else:
+                self._discard(fut)
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, fut: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def slot(self, max_wait: float | None = None):
+        await self.acquire(max_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "limit": self.limit,
+            "queue_size": self.max_queue,
+        }
+
+
+ask_limiter = ConcurrencyLimiter(
+    "ask",
+    limit=settings.ask_concurrency,
+    max_queue=settings.ask_queue_size,
+    max_wait=settings.ask_queue_timeout,
+)
+
+orginfo_limiter = ConcurrencyLimiter(
+    "orginfo",
+    limit=settings.orginfo_concurrency,
+    max_queue=settings.orginfo_queue_size,
+    max_wait=settings.orginfo_queue_timeout,
+)
@@ -1,8 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from backend.gpt import ask_gpt, handle_orginfo_query  # 👈 добавили handle_orginfo_query
+from backend.device_ws import handle_device_socket
+from backend.gpt import (  # 👈 добавили handle_orginfo_query
+    DEFAULT_MODE,
+    GENERATION_PROFILES,
+    ask_gpt,
+    handle_orginfo_query,
+)
+from backend.limiter import Overloaded, ask_limiter, orginfo_limiter
+from common.profiling import setup_profiling
+from config.settings import settings
 
 app = FastAPI(title="Robot backend")
 
@@ -14,9 +23,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Профилирование по заголовку X-Profile или каждого N-го запроса
+setup_profiling(app, "backend")
+
 
 class AskRequest(BaseModel):
     question: str
+    # Профиль генерации: normal / short / device (см. GENERATION_PROFILES)
+    mode: str = DEFAULT_MODE
 
 
 class AskResponse(BaseModel):
@@ -31,6 +45,28 @@ class OrgInfoResponse(BaseModel):
     answer: str
 
 
+def busy_error(e: Overloaded) -> HTTPException:
+    """503 с Retry-After — клиент сразу узнаёт, что сервер занят."""
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, retry later",
+        headers={"Retry-After": str(e.retry_after), "X-Queue-Depth": str(e.waiting)},
+    )
+
+
+def queue_budget(request: Request, expected_work: float) -> float | None:
+    """
+    Сколько можно ждать слот, чтобы клиент успел получить ответ:
+    его таймаут (заголовок X-Client-Timeout) минус ожидаемое время работы.
+    None — клиент таймаут не прислал, действует max_wait лимитера.
+    """
+    try:
+        client_timeout = float(request.headers["X-Client-Timeout"])
+    except (KeyError, ValueError):
+        return None
+    return client_timeout - expected_work
+
+
 @app.get("/")
 async def root():
     return {"status": "ok", "message": "Robot backend online"}
@@ -38,18 +74,31 @@ async def root():
 
 @app.get("/status")
 async def status():
-    return {"status": "ok", "mode": "online"}
+    return {
+        "status": "ok",
+        "mode": "online",
+        # Текущая загрузка: active – в работе, waiting – в очереди
+        "queues": {
+            "ask": ask_limiter.stats(),
+            "orginfo": orginfo_limiter.stats(),
+        },
+    }
 
 
 @app.post("/ask", response_model=AskResponse)
-async def ask_endpoint(req: AskRequest):
+async def ask_endpoint(req: AskRequest, request: Request):
     q = (req.question or "").strip()
     if not q:
         raise HTTPException(status_code=400, detail="Empty question")
+    if req.mode not in GENERATION_PROFILES:
+        raise HTTPException(status_code=400, detail="Unknown mode")
 
     try:
-        answer = await ask_gpt(q)
+        async with ask_limiter.slot(queue_budget(request, settings.ask_expected_work)):
+            answer = await ask_gpt(q, req.mode)
         return AskResponse(answer=answer)
+    except Overloaded as e:
+        raise busy_error(e)
     except HTTPException:
         raise
     except Exception as e:
@@ -58,7 +107,7 @@ async def ask_endpoint(req: AskRequest):
 
 
 @app.post("/orginfo_query", response_model=OrgInfoResponse)
-async def orginfo_endpoint(req: OrgInfoRequest):
+async def orginfo_endpoint(req: OrgInfoRequest, request: Request):
     """
     Эндпоинт для режима ORGINFO:
     - принимает свободный текст (ИНН, название, ФИО и т.п.)
@@ -70,8 +119,13 @@ async def orginfo_endpoint(req: OrgInfoRequest):
         raise HTTPException(status_code=400, detail="Empty query")
 
     try:
-        answer = await handle_orginfo_query(q)
+        async with orginfo_limiter.slot(
+            queue_budget(request, settings.orginfo_expected_work)
+        ):
+            answer = await handle_orginfo_query(q)
         return OrgInfoResponse(answer=answer)
+    except Overloaded as e:
+        raise busy_error(e)
     except HTTPException:
         raise
     except Exception as e:
@@ -79,6 +133,16 @@ async def orginfo_endpoint(req: OrgInfoRequest):
         raise HTTPException(status_code=500, detail="Orginfo request failed")
 
 
+@app.websocket("/ws")
+async def device_ws_endpoint(websocket: WebSocket):
+    """
+    Постоянный канал для ESP32: одно авторизованное соединение на устройство,
+    вопросы с id, ответы кусочками, heartbeat и resume после обрыва.
+    Протокол описан в backend/device_ws.py.
+    """
+    await handle_device_socket(websocket)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,284 @@
+"""
+Погода для любого города через Open-Meteo (без API ключа).
+
+- Координаты городов берём из геокодера Open-Meteo и кэшируем в локальном
+  JSON-файле (settings.geocode_cache_path), чтобы повторно не ходить в сеть.
+  Ненайденные слова помним только в памяти, ограниченно и на время.
+- Если в сообщении несколько городов, текущая погода для всех запрашивается
+  одним запросом к Open-Meteo (списки latitude/longitude через запятую).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from config.settings import settings
+
+GEOCODE_URL = "https://geocoding-api.open-meteo.com/v1/search"
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+DEFAULT_CITY = "ташкент"
+MAX_CITIES = 5
+MISS_TTL = 24 * 3600  # сек, сколько помним, что слово не геокодируется
+MAX_MISSES = 500
+
+# Заранее известные города — работают даже без доступа к геокодеру
+SEED_PLACES: dict[str, dict] = {
+    "ташкент": {"name": "Ташкент", "lat": 41.31, "lon": 69.28},
+}
+
+# "в Самарканде и Бухаре", "для Ташкента, Намангана", "по городу Фергана".
+# Одно слово на город; следующий город — только после запятой или "и".
+_LETTERS = r"[A-Za-zА-Яа-яЁёЎўҚқҒғҲҳ\-]+"
+CITY_LIST_RE = re.compile(
+    rf"(?:^|\s)(?:в|во|для|по)\s+(?:город\w*\s+)?"
+    rf"({_LETTERS}(?:(?:\s*,\s*|\s+и\s+){_LETTERS})*)",
+    re.IGNORECASE,
+)
+CITY_SPLIT_RE = re.compile(r"\s*(?:,|\bи\b)\s*", re.IGNORECASE)
+# Само слово-триггер ("погода в ...", "по погоде") городом не считаем
+TRIGGER_WORD_RE = re.compile(r"^погод", re.IGNORECASE)
+
+# Слова после "в/по/для", которые точно не города
+STOP_WORDS = {
+    "городе", "городах", "мире", "стране", "целом", "среднем", "общем",
+    "данный", "момент", "выходные", "неделю", "течение", "сейчас", "пути",
+    "пожалуйста", "сегодня", "завтра", "послезавтра", "утром", "вечером",
+    "понедельник", "вторник", "среду", "четверг", "пятницу", "субботу",
+    "воскресенье", "моём", "моем", "нашем", "этом", "том",
+}
+
+# Падежные окончания: "Самарканде" -> "Самарканд", "Бухаре" -> "Бухар"
+CASE_ENDINGS = ("ом", "ой", "е", "у", "а", "ы", "и")
+
+# Найденные места (сохраняются в файл) и недавние промахи (только в памяти)
+_cache: dict[str, dict] | None = None
+_misses: OrderedDict[str, float] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# ---------- Геокодинг с локальным кэшем ----------
+
+def _load_cache() -> dict[str, dict]:
+    global _cache
+    if _cache is None:
+        cache: dict[str, dict] = dict(SEED_PLACES)
+        try:
+            with open(settings.geocode_cache_path, encoding="utf-8") as f:
+                # Пустые записи (промахи из старых версий файла) пропускаем
+                cache.update({k: v for k, v in json.load(f).items() if v})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print("Geocode cache load error:", e)
+        _cache = cache
+    return _cache
+
+
+def _save_cache(cache: dict[str, dict]) -> None:
+    path = settings.geocode_cache_path
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print("Geocode cache save error:", e)
+
+
+def _geocode_remote(name: str) -> dict | None:
+    resp = requests.get(
+        GEOCODE_URL,
+        params={"name": name, "count": 1, "language": "ru", "format": "json"},
+        timeout=10,
+    )
+    resp.raise_for_status()
+    results = resp.json().get("results") or []
+    if not results:
+        return None
+    place = results[0]
+    return {
+        "name": place.get("name") or name,
+        "lat": place["latitude"],
+        "lon": place["longitude"],
+    }
+
+
+def _is_recent_miss(key: str) -> bool:
+    missed_at = _misses.get(key)
+    if missed_at is None:
+        return False
+    if time.monotonic() - missed_at > MISS_TTL:
+        del _misses[key]
+        return False
+    return True
+
+
+def _remember_miss(key: str) -> None:
+    _misses[key] = time.monotonic()
+    _misses.move_to_end(key)
+    while len(_misses) > MAX_MISSES:
+        _misses.popitem(last=False)
+
+
+def _name_variants(word: str) -> list[str]:
+    """Слово как есть и без падежного окончания."""
+    variants = [word]
+    for ending in CASE_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            variants.append(word[: -len(ending)])
+            break
+    return variants
+
+
+def _cached_place(key: str) -> dict | None:
+    """Место из кэша по слову или его форме без окончания (без сети)."""
+    with _cache_lock:
+        cache = _load_cache()
+        for variant in _name_variants(key):
+            if cache.get(variant):
+                return cache[variant]
+    return None
+
+
+def geocode(word: str) -> dict | None:
+    """
+    Координаты города по слову из сообщения (с учётом падежа).
+    Найденные места сохраняем в файл-кэш, промахи помним только в памяти.
+    """
+    key = word.strip().lower()
+    if not key:
+        return None
+
+    place = _cached_place(key)
+    if place:
+        return place
+
+    variants = _name_variants(key)
+    with _cache_lock:
+        if _is_recent_miss(key):
+            return None  # недавно искали и не нашли
+
+    place = None
+    try:
+        for variant in variants:
+            place = _geocode_remote(variant)
+            if place:
+                break
+    except Exception as e:
+        # Сетевую ошибку не кэшируем — попробуем в следующий раз
+        print("Geocode error:", e)
+        return None
+
+    with _cache_lock:
+        if place is None:
+            _remember_miss(key)
+        else:
+            cache = _load_cache()
+            cache[key] = place
+            _save_cache(cache)
+    return place
+
+
+def find_places(text: str) -> tuple[list[dict], list[str]]:
+    """
+    Ищем в тексте названия городов и геокодим их.
+    Кандидат — слово с заглавной буквы или уже известное кэшу, остальные
+    слова ("в среду", "для меня") пропускаем без запроса к геокодеру.
+    Возвращаем (найденные места, названия, которые найти не удалось).
+    Ташкент подставляем, только если город вообще не упомянут.
+    """
+    places: list[dict] = []
+    missing: list[str] = []
+    seen: set[tuple] = set()
+
+    for m in CITY_LIST_RE.finditer(text or ""):
+        for word in CITY_SPLIT_RE.split(m.group(1)):
+            if not word or word.lower() in STOP_WORDS or TRIGGER_WORD_RE.match(word):
+                continue
+            place = _cached_place(word.lower())
+            if not place and not word[0].isupper():
+                continue
+            if len(places) + len(missing) >= MAX_CITIES:
+                return places, missing
+            place = place or geocode(word)
+            if not place:
+                missing.append(word)
+                continue
+            coords = (place["lat"], place["lon"])
+            if coords in seen:
+                continue
+            seen.add(coords)
+            places.append(place)
+
+    if not places and not missing:
+        places.append(geocode(DEFAULT_CITY) or SEED_PLACES[DEFAULT_CITY])
+    return places, missing
+
+
+# ---------- Текущая погода (один запрос на все города) ----------
+
+def describe_weather_code(code: int | None) -> str:
+    description = "ясно"
+    if code is not None:
+        if code in (0,):
+            description = "ясно"
+        elif code in (1, 2, 3):
+            description = "переменная облачность"
+        elif 51 <= code <= 67:
+            description = "морось или небольшой дождь"
+        elif 71 <= code <= 77:
+            description = "снег"
+        elif 80 <= code <= 82:
+            description = "дождь"
+        elif 95 <= code <= 99:
+            description = "гроза"
+    return description
+
+
+def describe_missing(names: list[str]) -> str:
+    """Факты для GPT о городах, которые не нашёл геокодер."""
+    return "\n".join(f"{name}: город не найден, данных о погоде нет." for name in names)
+
+
+def get_current_weather(places: list[dict]) -> str:
+    """
+    Текущая погода для списка городов одним запросом к Open-Meteo.
+    Возвращаем короткие строки-факты для GPT (по строке на город).
+    """
+    if not places:
+        return "Не указан город для погоды."
+
+    try:
+        params = {
+            "latitude": ",".join(str(p["lat"]) for p in places),
+            "longitude": ",".join(str(p["lon"]) for p in places),
+            "current": "temperature_2m,weather_code",
+            "timezone": "auto",
+        }
+        resp = requests.get(FORECAST_URL, params=params, timeout=10)
+        resp.raise_for_status()
+        data = resp.json()
+
+        # Для одной точки Open-Meteo отдаёт объект, для нескольких — список
+        results = data if isinstance(data, list) else [data]
+
+        lines: list[str] = []
+        for place, item in zip(places, results):
+            current = item.get("current", {})
+            temp = current.get("temperature_2m")
+            if temp is None:
+                lines.append(f"{place['name']}: нет актуальных данных о температуре.")
+                continue
+            description = describe_weather_code(current.get("weather_code"))
+            lines.append(f"{place['name']}: сейчас около {temp:.0f} °C, {description}.")
+        return "\n".join(lines)
+    except Exception as e:
+        print("Weather error:", e)
+        names = ", ".join(p["name"] for p in places)
+        return f"Не удалось получить погоду ({names}): ошибка запроса."
@@ -13,6 +13,8 @@ from telebot import types
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
+from common.profiling import profile_handler, setup_profiling
+from bot.sender import OutboundSender, install_pooled_session
 from config.settings import settings
 
 
@@ -26,11 +28,23 @@ if not TELEGRAM_BOT_TOKEN:
 # Адрес для ORGINFO-запросов (ожидается, что backend даёт /orginfo_query)
 ORGINFO_URL = BACKEND_URL.replace("/ask", "/orginfo_query")
 
+# Таймауты запросов к backend (сек). Передаём их в X-Client-Timeout, чтобы
+# backend не держал запрос в очереди дольше, чем мы готовы ждать ответ.
+ASK_TIMEOUT = 20
+ORGINFO_TIMEOUT = 25
+
 # Инициализация Telegram-бота
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, parse_mode=None)
 
+# Исходящие сообщения — через очередь с учётом flood-лимитов Telegram
+install_pooled_session()
+sender = OutboundSender(bot)
+
 # FastAPI-приложение для Render (webhook)
 app = FastAPI()
+# /webhook только ставит апдейт в очередь TeleBot; сами хендлеры
+# профилируются декоратором profile_handler (по PROFILE_SAMPLE_RATE)
+setup_profiling(app, "bot")
 
 # Режимы работы по chat_id:
 # "normal"  – обычные ответы GPT
@@ -55,14 +69,25 @@ def main_keyboard() -> types.ReplyKeyboardMarkup:
     return kb
 
 
-def ask_backend(question: str) -> str:
-    """Отправка запроса на backend /ask (GPT)."""
+def busy_message(resp: requests.Response) -> str:
+    """Backend перегружен (503) — сразу говорим об этом, а не ждём таймаута."""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return f"⏳ Робот сейчас занят, попробуй ещё раз через {retry_after} с."
+    return "⏳ Робот сейчас занят, попробуй ещё раз чуть позже."
+
+
+def ask_backend(question: str, mode: str = "normal") -> str:
+    """Отправка запроса на backend /ask (GPT) с режимом генерации (normal/short)."""
     try:
         resp = requests.post(
             BACKEND_URL,
-            json={"question": question},
-            timeout=20,
+            json={"question": question, "mode": mode},
+            headers={"X-Client-Timeout": str(ASK_TIMEOUT)},
+            timeout=ASK_TIMEOUT,
         )
+        if resp.status_code == 503:
+            return busy_message(resp)
         resp.raise_for_status()
         data = resp.json()
         answer = (data.get("answer") or "").strip() or "Сервер вернул пустой ответ."
@@ -85,8 +110,11 @@ def ask_orginfo(query: str) -> str:
         resp = requests.post(
             ORGINFO_URL,
             json={"query": query},
-            timeout=25,
+            headers={"X-Client-Timeout": str(ORGINFO_TIMEOUT)},
+            timeout=ORGINFO_TIMEOUT,
         )
+        if resp.status_code == 503:
+            return busy_message(resp)
         resp.raise_for_status()
         data = resp.json()
         answer = (data.get("answer") or "").strip() or "Сервер orginfo вернул пустой ответ."
@@ -103,11 +131,12 @@ def ask_orginfo(query: str) -> str:
 # --------- Telegram handlers --------- #
 
 @bot.message_handler(commands=["start"])
+@profile_handler("bot")
 def handle_start(message: telebot.types.Message):
     chat_id = message.chat.id
     set_mode(chat_id, "normal")
 
-    bot.send_message(
+    sender.send_message(
         chat_id,
         "Привет! Я мозг настольного робота 🤖\n"
         "Пиши мне вопрос — я спрошу у ChatGPT.\n\n"
@@ -120,8 +149,9 @@ def handle_start(message: telebot.types.Message):
 
 
 @bot.message_handler(commands=["help"])
+@profile_handler("bot")
 def handle_help(message: telebot.types.Message):
-    bot.reply_to(
+    sender.reply_to(
         message,
         "Команды:\n"
         " /start – начать\n"
@@ -135,40 +165,47 @@ def handle_help(message: telebot.types.Message):
 
 
 @bot.message_handler(commands=["ping"])
+@profile_handler("bot")
 def handle_ping(message: telebot.types.Message):
     chat_id = message.chat.id
-    bot.send_chat_action(chat_id, "typing")
+    sender.send_chat_action(chat_id, "typing")
 
     try:
         status_url = BACKEND_URL.replace("/ask", "/status")
         resp = requests.get(status_url, timeout=5)
         if resp.status_code == 200:
-            bot.reply_to(message, "✅ Backend онлайн и готов к работе.")
+            queues = resp.json().get("queues") or {}
+            waiting = sum(q.get("waiting", 0) for q in queues.values())
+            if waiting:
+                sender.reply_to(message, f"✅ Backend онлайн, но занят: в очереди {waiting} запрос(ов).")
+            else:
+                sender.reply_to(message, "✅ Backend онлайн и готов к работе.")
         else:
-            bot.reply_to(
+            sender.reply_to(
                 message,
                 f"⚠️ Backend отвечает HTTP {resp.status_code}",
             )
     except Exception:
-        bot.reply_to(
+        sender.reply_to(
             message,
             "❌ Не удалось связаться с backend.",
         )
 
 
 @bot.message_handler(content_types=["text"])
+@profile_handler("bot")
 def handle_text(message: telebot.types.Message):
     """Обработка текста и кнопок."""
     text = (message.text or "").strip()
     chat_id = message.chat.id
 
     mode = get_mode(chat_id)
-    bot.send_chat_action(chat_id, "typing")
+    sender.send_chat_action(chat_id, "typing")
 
     # --- Переключение режимов кнопками ---
     if text == "Короткий режим":
         set_mode(chat_id, "short")
-        bot.send_message(
+        sender.send_message(
             chat_id,
             "Короткий режим включён 🧠📟",
             reply_markup=main_keyboard(),
@@ -177,7 +214,7 @@ def handle_text(message: telebot.types.Message):
 
     if text == "Обычный режим":
         set_mode(chat_id, "normal")
-        bot.send_message(
+        sender.send_message(
             chat_id,
             "Обычный режим включён 🙂",
             reply_markup=main_keyboard(),
@@ -186,7 +223,7 @@ def handle_text(message: telebot.types.Message):
 
     if text == "ORGINFO":
         set_mode(chat_id, "orginfo")
-        bot.send_message(
+        sender.send_message(
             chat_id,
             "Режим ORGINFO.\n"
             "Отправьте текст: ИНН, название компании, ФИО директора или другую информацию.\n"
@@ -202,17 +239,12 @@ def handle_text(message: telebot.types.Message):
         # После этого можно сбросить режим обратно в normal
         set_mode(chat_id, "normal")
         answer = ask_orginfo(text)
-        bot.send_message(chat_id, answer, reply_markup=main_keyboard())
+        sender.send_message(chat_id, answer, reply_markup=main_keyboard())
         return
 
-    # Обычный GPT-режим (short/normal)
-    if mode == "short":
-        q = f"Ответь очень коротко (1–2 предложения): {text}"
-    else:
-        q = text
-
-    answer = ask_backend(q)
-    bot.send_message(chat_id, answer, reply_markup=main_keyboard())
+    # Обычный GPT-режим (short/normal) — режим уходит на backend как профиль генерации
+    answer = ask_backend(text, mode)
+    sender.send_message(chat_id, answer, reply_markup=main_keyboard())
 
 
 # --------- FastAPI endpoints (для Render webhook) --------- #
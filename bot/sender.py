@@ -0,0 +1,258 @@
+"""
+Очередь исходящих сообщений в Telegram с учётом flood-лимитов.
+
+Хендлеры больше не ходят в api.telegram.org сами — они кладут сообщения
+в очередь, а несколько фоновых потоков отправляют их (медленный ответ
+Telegram одному чату не задерживает остальные):
+- token bucket на каждый чат (~1 сообщение/сек) и общий (~30/сек), общие
+  для всех потоков; один чат отправляет не больше одного запроса за раз,
+  поэтому порядок сообщений в чате сохраняется;
+- на 429 ждём столько, сколько сказал Telegram (retry_after): и этот чат,
+  и вся отправка бота, затем повторяем;
+- лишние "typing" схлопываются (статус и так держится ~5 секунд);
+- несколько текстов подряд в один чат склеиваются в одно сообщение;
+- все запросы идут через общий requests.Session с пулом соединений
+  (по соединению на поток отправки).
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+
+PER_CHAT_RATE = 1.0  # сообщений в секунду на чат
+PER_CHAT_BURST = 3
+GLOBAL_RATE = 30.0  # сообщений в секунду на бота
+GLOBAL_BURST = 30
+TYPING_TTL = 4.5  # сек, пока Telegram показывает "печатает..."
+MAX_MESSAGE_LEN = 4096  # лимит Telegram на длину текста
+MAX_429_RETRIES = 5
+MAX_TRACKED_CHATS = 10000
+SENDER_WORKERS = 4  # потоков отправки
+POOL_SIZE = SENDER_WORKERS
+
+
+def install_pooled_session(pool_size: int = POOL_SIZE) -> None:
+    """Общий requests.Session с пулом keep-alive соединений для всех вызовов telebot."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    apihelper.session = session
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 – можно отправлять)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+def _retry_after(e: Exception) -> float | None:
+    """Сколько секунд ждать, если Telegram ответил 429 Too Many Requests."""
+    if isinstance(e, ApiTelegramException) and e.error_code == 429:
+        params = (e.result_json or {}).get("parameters") or {}
+        return float(params.get("retry_after") or 1)
+    return None
+
+
+def _batch_key(kwargs: dict) -> str:
+    """Сообщения склеиваем, только если у них одинаковые параметры (клавиатура и т.п.)."""
+    plain = {
+        k: (v.to_json() if hasattr(v, "to_json") else v)
+        for k, v in kwargs.items()
+    }
+    return json.dumps(plain, sort_keys=True, default=str)
+
+
+class OutboundSender:
+    def __init__(self, bot):
+        self.bot = bot
+        self._cond = threading.Condition()
+        # chat_id -> очередь заданий; порядок словаря = round-robin по чатам
+        self._queues: OrderedDict[int, deque] = OrderedDict()
+        self._buckets: dict[int, TokenBucket] = {}
+        self._blocked_until: dict[int, float] = {}
+        self._typing_sent: dict[int, float] = {}
+        self._inflight: set[int] = set()  # чаты, запрос в которые сейчас отправляется
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._global_blocked_until = 0.0
+        self._threads: list[threading.Thread] = []
+
+    # --------- Публичный API (вызывается из хендлеров) --------- #
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        self._enqueue(chat_id, {
+            "kind": "message",
+            "chat_id": chat_id,
+            "text": text,
+            "kwargs": kwargs,
+            "key": _batch_key(kwargs),
+        })
+
+    def reply_to(self, message, text: str, **kwargs) -> None:
+        self.send_message(
+            message.chat.id, text, reply_to_message_id=message.message_id, **kwargs
+        )
+
+    def send_chat_action(self, chat_id: int, action: str = "typing") -> None:
+        with self._cond:
+            if action == "typing":
+                recently = time.monotonic() - self._typing_sent.get(chat_id, float("-inf"))
+                # Статус ещё виден или в чат уже что-то ждёт отправки — повтор не нужен
+                if recently < TYPING_TTL or self._queues.get(chat_id):
+                    return
+                self._typing_sent[chat_id] = time.monotonic()
+        self._enqueue(chat_id, {"kind": "action", "chat_id": chat_id, "action": action})
+
+    # --------- Очередь --------- #
+
+    def _enqueue(self, chat_id: int, job: dict) -> None:
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(job)
+            self._ensure_threads()
+            self._cond.notify()
+
+    def _ensure_threads(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < SENDER_WORKERS:
+            thread = threading.Thread(
+                target=self._run, name=f"telegram-sender-{len(self._threads) + 1}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > MAX_TRACKED_CHATS:
+                self._prune()
+            bucket = self._buckets[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+        return bucket
+
+    def _prune(self) -> None:
+        """Забываем состояние чатов, которым сейчас нечего отправлять."""
+        now = time.monotonic()
+        for chat_id in list(self._buckets):
+            if (
+                chat_id not in self._queues
+                and chat_id not in self._inflight
+                and self._blocked_until.get(chat_id, 0) <= now
+            ):
+                self._buckets.pop(chat_id, None)
+                self._blocked_until.pop(chat_id, None)
+                self._typing_sent.pop(chat_id, None)
+
+    def _merge_batch(self, job: dict, jobs: deque) -> None:
+        """Склеиваем следующие тексты в тот же чат с теми же параметрами."""
+        while jobs:
+            nxt = jobs[0]
+            if nxt["kind"] != "message" or nxt["key"] != job["key"]:
+                break
+            merged = f"{job['text']}\n\n{nxt['text']}"
+            if len(merged) > MAX_MESSAGE_LEN:
+                break
+            job["text"] = merged
+            jobs.popleft()
+
+    def _next_job(self) -> dict:
+        """Ждём, пока какой-нибудь чат сможет отправить сообщение, и берём его задание."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                global_wait = max(
+                    self._global.wait_time(now), self._global_blocked_until - now
+                )
+                wait = None
+
+                for chat_id, jobs in self._queues.items():
+                    if chat_id in self._inflight:
+                        continue  # дождёмся ответа на предыдущий запрос в этот чат
+                    ready_in = max(
+                        self._bucket(chat_id).wait_time(now),
+                        self._blocked_until.get(chat_id, 0) - now,
+                        global_wait,
+                    )
+                    if ready_in <= 0:
+                        job = jobs.popleft()
+                        if job["kind"] == "message":
+                            self._merge_batch(job, jobs)
+                        if jobs:
+                            self._queues.move_to_end(chat_id)
+                        else:
+                            del self._queues[chat_id]
+                        self._bucket(chat_id).take(now)
+                        self._global.take(now)
+                        self._inflight.add(chat_id)
+                        return job
+                    wait = ready_in if wait is None else min(wait, ready_in)
+
+                self._cond.wait(timeout=wait)
+
+    def _finish(self, job: dict, delay: float | None = None, retry: bool = False) -> None:
+        """
+        Задание отправлено (или нет). delay — Telegram попросил подождать:
+        блокируем чат и всю отправку; retry — вернуть задание в начало очереди.
+        """
+        chat_id = job["chat_id"]
+        with self._cond:
+            self._inflight.discard(chat_id)
+            if delay is not None:
+                until = time.monotonic() + delay
+                self._blocked_until[chat_id] = until
+                self._global_blocked_until = max(self._global_blocked_until, until)
+            if retry:
+                self._queues.setdefault(chat_id, deque()).appendleft(job)
+                self._queues.move_to_end(chat_id, last=False)
+            self._cond.notify_all()
+
+    # --------- Фоновые потоки --------- #
+
+    def _send(self, job: dict) -> None:
+        if job["kind"] == "action":
+            self.bot.send_chat_action(job["chat_id"], job["action"])
+        else:
+            self.bot.send_message(job["chat_id"], job["text"], **job["kwargs"])
+            # После сообщения Telegram сам снимает статус "печатает..."
+            with self._cond:
+                self._typing_sent.pop(job["chat_id"], None)
+
+    def _run(self) -> None:
+        while True:
+            job = self._next_job()
+            try:
+                self._send(job)
+            except Exception as e:
+                delay = _retry_after(e)
+                retries = job.get("retries", 0)
+                # "typing" после паузы уже не актуален — его не повторяем
+                retry = delay is not None and job["kind"] == "message" and retries < MAX_429_RETRIES
+                if delay is not None:
+                    print(f"Telegram 429 для чата {job['chat_id']}, ждём {delay} с")
+                if retry:
+                    job["retries"] = retries + 1
+                else:
+                    print("Telegram send error:", e)
+                self._finish(job, delay, retry)
+            else:
+                self._finish(job)
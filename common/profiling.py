@@ -0,0 +1,274 @@
+"""
+Профилирование живых запросов по требованию (для обоих FastAPI-приложений).
+
+Модуль общий для backend и бота, поэтому лежит вне их пакетов: бот не
+тянет за собой модули backend.
+
+Включение:
+- заголовок X-Profile: <PROFILE_TOKEN> — профилировать этот запрос;
+- PROFILE_SAMPLE_RATE=N — профилировать каждый N-й запрос (0 – выключено).
+
+Пока запрос выполняется, фоновый поток каждые PROFILE_INTERVAL_MS снимает
+стеки всех потоков (sys._current_frames): event loop, потоки asyncio.to_thread
+и т.д. Простаивающие рабочие потоки отбрасываются. Одновременно профилируется
+только один запрос, но другие запросы в том же процессе тоже попадут в сэмплы.
+
+Результат сохраняется в PROFILE_DIR в формате collapsed stacks
+("thread;func (file:line);... count") — его понимают flamegraph.pl,
+speedscope и inferno. Храним только последние PROFILE_KEEP файлов.
+
+Список профилей: GET /debug/profiles, файл: GET /debug/profiles/{name}
+(оба с заголовком X-Profile: <PROFILE_TOKEN>).
+
+Если не заданы ни PROFILE_TOKEN, ни PROFILE_SAMPLE_RATE, middleware и
+эндпоинты не подключаются вовсе — на обычные запросы это ничего не стоит.
+
+Бот: TeleBot выполняет хендлеры в своём пуле потоков, а /webhook только
+ставит апдейт в очередь, поэтому профиль /webhook почти пустой. Хендлеры
+профилируются декоратором profile_handler — только по PROFILE_SAMPLE_RATE
+(заголовок из запроса до хендлера не доходит).
+"""
+
+import asyncio
+import functools
+import hmac
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from config.settings import settings
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_MAX_SECONDS = 30  # дольше не сэмплируем даже очень долгий запрос
+PROFILE_NAME_RE = re.compile(r"^[\w.\-]+\.folded$")
+
+# Листовые функции простаивающих потоков (ждут задачу или событие)
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),  # пул asyncio.to_thread / ThreadPoolExecutor
+}
+
+_counter = itertools.count(1)
+_busy = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Фоновый поток: периодически снимает стеки и считает одинаковые."""
+
+    def __init__(self, interval: float, request_thread: int):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.request_thread = request_thread
+        self.counts: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        deadline = time.monotonic() + PROFILE_MAX_SECONDS
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                # Поток запроса оставляем и в ожидании (видно, где ждём I/O)
+                if ident != self.request_thread and leaf in IDLE_LEAVES:
+                    continue
+                stack: list[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame).replace(";", ":"))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+# ---------- Хранение профилей ----------
+
+def _save_profile(service: str, label: str, duration_ms: int, data: str) -> str:
+    os.makedirs(settings.profile_dir, exist_ok=True)
+    slug = re.sub(r"[^\w\-]+", "_", label).strip("_") or "root"
+    name = f"{int(time.time() * 1000)}_{service}_{slug}_{duration_ms}ms.folded"
+    with open(os.path.join(settings.profile_dir, name), "w", encoding="utf-8") as f:
+        f.write(data)
+    _enforce_retention()
+    return name
+
+
+def _enforce_retention() -> None:
+    """Оставляем только последние settings.profile_keep файлов."""
+    profiles = _list_profiles()
+    for info in profiles[max(0, settings.profile_keep):]:
+        try:
+            os.remove(os.path.join(settings.profile_dir, info["name"]))
+        except OSError:
+            pass
+
+
+def _list_profiles() -> list[dict]:
+    try:
+        entries = [e for e in os.scandir(settings.profile_dir)
+                   if e.is_file() and PROFILE_NAME_RE.match(e.name)]
+    except FileNotFoundError:
+        return []
+    profiles = [
+        {"name": e.name, "size": e.stat().st_size, "created": e.stat().st_mtime}
+        for e in entries
+    ]
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+    return profiles
+
+
+def _read_profile(name: str) -> str | None:
+    try:
+        with open(os.path.join(settings.profile_dir, name), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+# ---------- Middleware и эндпоинты ----------
+
+def _token_ok(request: Request) -> bool:
+    expected = settings.profile_token
+    given = request.headers.get(PROFILE_HEADER)
+    if not expected or given is None:
+        return False
+    # Байты: compare_digest со str падает на не-ASCII символах
+    return hmac.compare_digest(given.encode(), expected.encode())
+
+
+def _sample_hit() -> bool:
+    rate = settings.profile_sample_rate
+    return rate > 0 and next(_counter) % rate == 0
+
+
+def _should_profile(request: Request) -> bool:
+    if request.url.path.startswith("/debug/profiles"):
+        return False
+    return _token_ok(request) or _sample_hit()
+
+
+def _profiling_enabled() -> bool:
+    return bool(settings.profile_token) or settings.profile_sample_rate > 0
+
+
+def _new_sampler() -> StackSampler:
+    # Интервал 0 превратил бы сэмплер в busy-loop с захваченным GIL
+    interval = max(1, settings.profile_interval_ms) / 1000
+    return StackSampler(interval, threading.get_ident())
+
+
+def profile_handler(service: str):
+    """
+    Декоратор для синхронных хендлеров (бот): каждый N-й вызов профилируется
+    в том потоке, где он выполняется. При выключенном сэмплинге функция
+    возвращается как есть.
+    """
+    def decorator(func):
+        if settings.profile_sample_rate <= 0:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sample_hit() or not _busy.acquire(blocking=False):
+                return func(*args, **kwargs)
+
+            sampler = _new_sampler()
+            started = time.monotonic()
+            sampler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sampler.stop()
+                _busy.release()
+                duration_ms = int((time.monotonic() - started) * 1000)
+                try:
+                    _save_profile(service, f"handler_{func.__name__}", duration_ms,
+                                  sampler.collapsed())
+                except Exception as e:
+                    print("Profile save error:", e)
+
+        return wrapper
+
+    return decorator
+
+
+router = APIRouter(prefix="/debug/profiles")
+
+
+@router.get("")
+async def list_profiles(request: Request):
+    if not _token_ok(request):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {"profiles": await asyncio.to_thread(_list_profiles)}
+
+
+@router.get("/{name}", response_class=PlainTextResponse)
+async def download_profile(name: str, request: Request):
+    if not _token_ok(request):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not PROFILE_NAME_RE.match(name):
+        raise HTTPException(status_code=400, detail="Bad profile name")
+    data = await asyncio.to_thread(_read_profile, name)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(data)
+
+
+def setup_profiling(app: FastAPI, service: str) -> None:
+    """Подключает к приложению middleware профилирования и /debug/profiles."""
+    if not _profiling_enabled():
+        return
+
+    @app.middleware("http")
+    async def profile_middleware(request: Request, call_next):
+        if not _should_profile(request) or not _busy.acquire(blocking=False):
+            return await call_next(request)
+
+        sampler = _new_sampler()
+        started = time.monotonic()
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+            _busy.release()
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        try:
+            name = await asyncio.to_thread(
+                _save_profile,
+                service,
+                f"{request.method}_{request.url.path}",
+                duration_ms,
+                sampler.collapsed(),
+            )
+            response.headers["X-Profile-Id"] = name
+        except Exception as e:
+            print("Profile save error:", e)
+        return response
+
+    app.include_router(router)
@@ -4,6 +4,8 @@ from typing import Optional
 class Settings(BaseSettings):
     openai_api_key: str
     openai_model: str = "gpt-4o"
+    # Быстрая модель для коротких режимов (short / device)
+    openai_fast_model: str = "gpt-4o-mini"
 
     telegram_bot_token: str
     backend_url: str
@@ -13,6 +15,38 @@ class Settings(BaseSettings):
     google_api_key: Optional[str] = None
     google_cse_id: Optional[str] = None
 
+    # Локальный кэш геокодинга городов для погоды
+    geocode_cache_path: str = "geocode_cache.json"
+
+    # Серверный секрет WebSocket-канала устройств (/ws): из него выводятся
+    # токены устройств (см. backend/device_ws.py). Без него канал закрыт.
+    device_token: Optional[str] = None
+
+    # Backpressure: сколько запросов обрабатываем параллельно, сколько ждут
+    # в очереди и сколько секунд максимум можно ждать слот (иначе 503).
+    # *_expected_work — сколько обычно длится сама обработка: если клиент
+    # прислал свой таймаут (X-Client-Timeout), слот ждём не дольше
+    # "таймаут клиента − expected_work". Ожидание + работа должны укладываться
+    # в таймауты бота (20 с для /ask, 25 с для /orginfo_query).
+    # Лимиты действуют на один процесс: при нескольких воркерах uvicorn
+    # общий предел = значение × число воркеров.
+    ask_concurrency: int = 8
+    ask_queue_size: int = 16
+    ask_queue_timeout: float = 8.0
+    ask_expected_work: float = 12.0
+    orginfo_concurrency: int = 2
+    orginfo_queue_size: int = 4
+    orginfo_queue_timeout: float = 8.0
+    orginfo_expected_work: float = 17.0
+
+    # Профилирование запросов (common/profiling.py): токен для заголовка
+    # X-Profile, каждый N-й запрос (0 – выкл), папка и сколько файлов хранить
+    profile_token: Optional[str] = None
+    profile_sample_rate: int = 0
+    profile_interval_ms: int = 5
+    profile_dir: str = "profiles"
+    profile_keep: int = 50
+
     class Config:
         env_file = ".env"
 
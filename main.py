@@ -1,36 +1,243 @@
+"""
+Локальный запуск backend + Telegram-бота под супервизором.
+
+- Каждый сервис — uvicorn с настраиваемым числом воркеров (по умолчанию по
+  одному: состояние сервисов хранится в памяти процесса, см. ниже).
+- Вместо sleep ждём готовности: опрашиваем /status у backend и / у бота.
+- Упавший сервис перезапускается с растущей паузой (backoff).
+- При остановке сервисы получают мягкий сигнал и дорабатывают текущие запросы.
+
+Настройки через переменные окружения:
+  BACKEND_PORT (3000), BOT_PORT (8000),
+  BACKEND_WORKERS (1), BOT_WORKERS (1),
+  READY_TIMEOUT (30 сек), SHUTDOWN_GRACE (20 сек).
+
+Учтите, что у каждого воркера своё состояние в памяти:
+- режимы чатов бота;
+- WebSocket-сессии устройств (/ws) — resume после обрыва может попасть
+  в другой воркер и не найти сессию;
+- лимиты backpressure — реальный предел параллельности равен
+  ASK_CONCURRENCY × BACKEND_WORKERS, а /status показывает очередь только
+  ответившего воркера.
+"""
+
+import os
+import signal
 import subprocess
 import sys
 import time
+import urllib.request
+
+HOST = "0.0.0.0"
+POLL_INTERVAL = 0.5  # сек между проверками процессов
+BACKOFF_MIN = 1  # сек до первого перезапуска
+BACKOFF_MAX = 60  # потолок паузы между перезапусками
+STABLE_AFTER = 60  # если процесс прожил столько секунд, backoff сбрасывается
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"⚠️ {name} должно быть числом, используем {default}")
+        return default
+
+
+READY_TIMEOUT = env_int("READY_TIMEOUT", 30)
+SHUTDOWN_GRACE = env_int("SHUTDOWN_GRACE", 20)
+
+
+class Service:
+    """Один uvicorn-сервис: запуск, проверка готовности, перезапуск, остановка."""
+
+    def __init__(self, title: str, app: str, port: int, workers: int, health_path: str):
+        self.title = title
+        self.app = app
+        self.port = port
+        self.workers = max(1, workers)
+        self.health_url = f"http://127.0.0.1:{port}{health_path}"
+
+        self.proc: subprocess.Popen | None = None
+        self.started_at = 0.0
+        self.backoff = BACKOFF_MIN
+        self.next_start = 0.0
+
+    def command(self) -> list[str]:
+        return [
+            sys.executable, "-m", "uvicorn", self.app,
+            "--host", HOST,
+            "--port", str(self.port),
+            "--workers", str(self.workers),
+            "--timeout-graceful-shutdown", str(SHUTDOWN_GRACE),
+        ]
+
+    def start(self) -> None:
+        print(f"{self.title}: запуск ({self.workers} воркер(а), порт {self.port})...")
+        # Отдельная группа процессов: CTRL+C получает только супервизор,
+        # а сервисы он останавливает сам и по очереди.
+        if os.name == "nt":
+            kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            kwargs = {"start_new_session": True}
+        self.proc = subprocess.Popen(self.command(), **kwargs)
+        self.started_at = time.monotonic()
 
+    def is_ready(self) -> bool:
+        try:
+            with urllib.request.urlopen(self.health_url, timeout=2) as resp:
+                return resp.status == 200
+        except Exception:
+            return False
 
-def run_backend():
-    """Запуск backend-сервера в отдельном процессе."""
-    print("🚀 Запуск backend сервера...")
-    return subprocess.Popen([sys.executable, "-m", "backend.main"])
+    def wait_ready(self, timeout: float) -> bool:
+        """Ждём, пока сервис начнёт отвечать (или процесс умрёт)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc is None or self.proc.poll() is not None:
+                return False
+            if self.is_ready():
+                return True
+            time.sleep(0.25)
+        return False
 
+    def check(self) -> None:
+        """Вызывается в цикле супервизора: замечаем падение и перезапускаем."""
+        now = time.monotonic()
 
-def run_bot():
-    """Запуск Telegram-бота в отдельном процессе."""
-    print("🤖 Запуск Telegram-бота...")
-    return subprocess.Popen([sys.executable, "-m", "bot.bot"])
+        if self.proc is not None:
+            code = self.proc.poll()
+            if code is None:
+                return
+            if now - self.started_at >= STABLE_AFTER:
+                self.backoff = BACKOFF_MIN
+            print(f"💥 {self.title} завершился с кодом {code}, перезапуск через {self.backoff} с")
+            self.proc = None
+            self.next_start = now + self.backoff
+            self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+            return
+
+        if now >= self.next_start:
+            self.start()
+
+    def send_stop(self) -> None:
+        """Мягкая остановка: uvicorn перестаёт принимать запросы и дожидается текущих."""
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            if os.name == "nt":
+                self.proc.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                self.proc.send_signal(signal.SIGTERM)
+        except Exception as e:
+            print(f"{self.title}: не удалось отправить сигнал остановки:", e)
+
+    def wait_stopped(self, deadline: float) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"{self.title}: не успел завершиться, принудительная остановка")
+            self.kill()
+        self.proc = None
+
+    def kill(self) -> None:
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except Exception as e:
+            print(f"{self.title}: не удалось остановить процесс:", e)
+
+
+def shutdown(services: list[Service]) -> None:
+    # Повторный CTRL+C / SIGTERM не должен прервать остановку на полпути
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    try:
+        # Сигнал остановки всем сразу (бот первым — перестаёт принимать апдейты),
+        # потом ждём всех с общим дедлайном
+        for service in reversed(services):
+            print(f"⛔ Остановка: {service.title}...")
+            service.send_stop()
+        deadline = time.monotonic() + SHUTDOWN_GRACE + 5
+        for service in reversed(services):
+            service.wait_stopped(deadline)
+    finally:
+        for service in services:
+            service.kill()
+
+
+def _device_token_configured() -> bool:
+    """DEVICE_TOKEN из окружения или .env — без импорта настроек приложения."""
+    if os.environ.get("DEVICE_TOKEN"):
+        return True
+    try:
+        with open(".env", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key.strip().upper() == "DEVICE_TOKEN" and value.strip().strip("'\""):
+                    return True
+    except OSError:
+        pass
+    return False
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
 
 if __name__ == "__main__":
     print("=== ROBOT BOT STARTER ===")
 
-    backend = run_backend()
-    time.sleep(2)  # ждём, пока backend поднимется
+    backend = Service(
+        "Backend",
+        "backend.main:app",
+        port=env_int("BACKEND_PORT", 3000),
+        workers=env_int("BACKEND_WORKERS", 1),
+        health_path="/status",
+    )
+    bot = Service(
+        "Telegram-бот",
+        "bot.bot:app",
+        port=env_int("BOT_PORT", 8000),
+        workers=env_int("BOT_WORKERS", 1),
+        health_path="/",
+    )
+    services = [backend, bot]
 
-    bot = run_bot()
+    if backend.workers > 1:
+        print(
+            f"⚠️ BACKEND_WORKERS={backend.workers}: лимиты /ask и /orginfo_query "
+            "действуют на каждый воркер отдельно, /status показывает только один воркер."
+        )
+        if _device_token_configured():
+            print(
+                "⚠️ Задан DEVICE_TOKEN, но воркеров несколько: resume WebSocket-сессий "
+                "устройств ненадёжен (сессия хранится в памяти одного воркера)."
+            )
 
-    print("\n✔ Все сервисы запущены! (бот + backend)")
-    print("❗ Чтобы остановить — закрой это окно или нажмите CTRL+C\n")
+    # SIGTERM (например, от systemd/docker) обрабатываем как CTRL+C
+    signal.signal(signal.SIGTERM, _raise_interrupt)
 
     try:
-        backend.wait()
-        bot.wait()
+        for service in services:
+            service.start()
+            if service.wait_ready(READY_TIMEOUT):
+                print(f"✔ {service.title} готов")
+            else:
+                print(f"⚠️ {service.title} не ответил за {READY_TIMEOUT} с, супервизор продолжит следить")
+
+        print("\n✔ Все сервисы запущены! (бот + backend)")
+        print("❗ Чтобы остановить — закрой это окно или нажмите CTRL+C\n")
+
+        while True:
+            for service in services:
+                service.check()
+            time.sleep(POLL_INTERVAL)
     except KeyboardInterrupt:
         print("\n⛔ Остановка сервисов...")
-        backend.terminate()
-        bot.terminate()
+        shutdown(services)
         print("Готово.")